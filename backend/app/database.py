@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, JSON, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -31,6 +31,7 @@ class Document(Base):
     filename = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
     file_type = Column(String, nullable=False)
+    content_hash = Column(String, index=True)  # SHA-256 of the uploaded content
     stack_id = Column(Integer, nullable=True)  # Optional association with a stack
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -52,3 +53,14 @@ def get_db():
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+def add_missing_columns():
+    """Add columns introduced after a table was first created - create_all never alters existing tables"""
+    columns = {column["name"] for column in inspect(engine).get_columns("documents")}
+    if "content_hash" not in columns:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE documents ADD COLUMN content_hash VARCHAR"))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash)"
+            ))
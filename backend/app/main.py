@@ -1,24 +1,79 @@
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
-import shutil
+import json
 from datetime import datetime
 
 from .database import get_db, create_tables, Stack, Document, ChatLog
 from .models import (
     StackCreate, StackUpdate, StackResponse, DocumentResponse, 
-    ChatMessage, ChatResponse, WorkflowConfig, QueryRequest
+    ChatMessage, ChatResponse, WorkflowConfig, QueryRequest, BatchQueryRequest,
+    EmbeddingMigrationRequest, EmbeddingMigrationStatus
 )
 from .services.workflow_executor import WorkflowExecutor
-from .services.document_processor import DocumentProcessor
+from .services.document_processor import DocumentProcessor, UploadTooLargeError
+from .services.embedding_migration import EmbeddingMigrator
 
 # Create tables
 create_tables()
 
+# Maximum accepted upload size, enforced on the request body as it arrives
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "50")) * 1024 * 1024
+
+# Allowance for multipart boundaries and form fields around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """Reject upload request bodies over the size limit while they arrive.
+
+    FastAPI parses multipart forms before the endpoint runs, so the limit has
+    to be applied to the raw request: up front from Content-Length, and by
+    counting bytes for requests that omit it or lie about it.
+    """
+    
+    def __init__(self, app, path: str, max_file_size: int, overhead: int = 0):
+        self.app = app
+        self.path = path
+        self.max_file_size = max_file_size
+        self.max_body_size = max_file_size + overhead
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+        
+        detail = f"File exceeds maximum upload size of {self.max_file_size} bytes"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
 app = FastAPI(title="GenAI Stack API", version="1.0.0")
 
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    path="/documents/upload",
+    max_file_size=MAX_UPLOAD_SIZE,
+    overhead=MULTIPART_OVERHEAD
+)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -31,9 +86,16 @@ app.add_middleware(
 # Initialize services
 workflow_executor = WorkflowExecutor()
 document_processor = DocumentProcessor()
+embedding_migrator = EmbeddingMigrator(workflow_executor.embedding_service)
 
 # Create uploads directory
-os.makedirs("uploads", exist_ok=True)
+UPLOAD_DIR = "uploads"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+@app.on_event("shutdown")
+def shutdown():
+    # Index shards live on disk only for the lifetime of the in-memory store
+    workflow_executor.embedding_service.close()
 
 @app.get("/")
 def health_check():
@@ -104,25 +166,36 @@ def upload_document(
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
-    # Save file
-    file_path = f"uploads/{file.filename}"
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Store document metadata
-    db_document = Document(
-        filename=file.filename,
-        file_path=file_path,
-        file_type=file.content_type,
-        stack_id=stack_id
-    )
-    db.add(db_document)
-    db.commit()
-    db.refresh(db_document)
+    # Stream file to a content-addressed path
+    try:
+        file_path, content_hash, _ = document_processor.save_upload(
+            file.file, UPLOAD_DIR, MAX_UPLOAD_SIZE, extension=".pdf"
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    # Store document metadata, reusing the record if this stack already has the file
+    db_document = db.query(Document).filter(
+        Document.content_hash == content_hash,
+        Document.stack_id == stack_id
+    ).first()
+    if not db_document:
+        db_document = Document(
+            filename=file.filename,
+            file_path=file_path,
+            file_type=file.content_type,
+            content_hash=content_hash,
+            stack_id=stack_id
+        )
+        db.add(db_document)
+        db.commit()
+        db.refresh(db_document)
     
     # Process document for embeddings
     try:
-        result = workflow_executor.process_document(file_path, file.content_type, stack_id)
+        result = workflow_executor.process_document(
+            file_path, file.content_type, stack_id, content_hash=content_hash
+        )
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["error"])
     except Exception as e:
@@ -131,7 +204,10 @@ def upload_document(
     return {
         "message": "Document uploaded and processed successfully",
         "document_id": db_document.id,
-        "chunks_created": result.get("chunks_created", 0)
+        "content_hash": content_hash,
+        "chunks_created": result.get("chunks_created", 0),
+        "chunks_reused": result.get("chunks_reused", 0),
+        "deduplicated": result.get("deduplicated", False)
     }
 
 @app.get("/documents/", response_model=List[DocumentResponse])
@@ -144,8 +220,8 @@ def get_documents(stack_id: Optional[int] = None, db: Session = Depends(get_db))
 
 # Workflow execution endpoints
 @app.post("/workflows/validate")
-def validate_workflow(workflow_config: WorkflowConfig):
-    validation = workflow_executor.validate_workflow(workflow_config)
+def validate_workflow(workflow_config: WorkflowConfig, stack_id: Optional[int] = None):
+    validation = workflow_executor.validate_workflow(workflow_config, stack_id)
     return validation
 
 @app.post("/workflows/execute")
@@ -180,7 +256,74 @@ def execute_workflow(query_request: QueryRequest, db: Session = Depends(get_db))
     
     return result
 
+@app.post("/workflows/execute-batch")
+def execute_workflow_batch(batch_request: BatchQueryRequest, db: Session = Depends(get_db)):
+    # Get stack and parse its workflow configuration once for the whole batch
+    stack = db.query(Stack).filter(Stack.id == batch_request.stack_id).first()
+    if not stack:
+        raise HTTPException(status_code=404, detail="Stack not found")
+    
+    if not stack.workflow_config:
+        raise HTTPException(status_code=400, detail="Stack has no workflow configuration")
+    
+    workflow_config = WorkflowConfig(**stack.workflow_config)
+    
+    # Validate before streaming, while an error status can still be returned
+    validation = workflow_executor.validate_workflow(workflow_config, batch_request.stack_id)
+    if not validation["valid"]:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid workflow configuration", "details": validation["errors"]}
+        )
+    
+    # Stream one JSON object per line as each query completes
+    results = workflow_executor.execute_workflow_batch(
+        workflow_config,
+        batch_request.queries,
+        batch_request.stack_id,
+        max_concurrency=batch_request.max_concurrency
+    )
+    # Warnings such as an embedding model mismatch ride along in a header
+    headers = {"X-Workflow-Warnings": json.dumps(validation["warnings"])} if validation["warnings"] else None
+    return StreamingResponse(
+        (json.dumps(result) + "\n" for result in results),
+        media_type="application/x-ndjson",
+        headers=headers
+    )
+
 @app.get("/stacks/{stack_id}/chat-history", response_model=List[ChatResponse])
 def get_chat_history(stack_id: int, db: Session = Depends(get_db)):
     chat_logs = db.query(ChatLog).filter(ChatLog.stack_id == stack_id).order_by(ChatLog.created_at.desc()).all()
     return chat_logs
+
+# Embedding migration endpoints
+@app.post("/stacks/{stack_id}/embedding-migration", response_model=EmbeddingMigrationStatus)
+def start_embedding_migration(stack_id: int, migration: EmbeddingMigrationRequest, db: Session = Depends(get_db)):
+    stack = db.query(Stack).filter(Stack.id == stack_id).first()
+    if not stack:
+        raise HTTPException(status_code=404, detail="Stack not found")
+    
+    if migration.embedding_model not in ("openai", "gemini"):
+        raise HTTPException(status_code=400, detail=f"Unsupported embedding model: {migration.embedding_model}")
+    
+    current = embedding_migrator.get_status(str(stack_id))
+    if current and current["status"] == "running":
+        raise HTTPException(status_code=409, detail="A migration is already running for this stack")
+    
+    # Runs in the background; queries keep using the current index until the swap
+    try:
+        return embedding_migrator.start_migration(
+            str(stack_id),
+            migration.embedding_model,
+            batch_size=migration.batch_size,
+            requests_per_minute=migration.requests_per_minute
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/stacks/{stack_id}/embedding-migration", response_model=EmbeddingMigrationStatus)
+def get_embedding_migration(stack_id: int):
+    status = embedding_migrator.get_status(str(stack_id))
+    if not status:
+        raise HTTPException(status_code=404, detail="No embedding migration found for this stack")
+    return status
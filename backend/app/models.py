@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
@@ -29,6 +29,7 @@ class DocumentResponse(BaseModel):
     filename: str
     file_path: str
     file_type: str
+    content_hash: Optional[str] = None
     stack_id: Optional[int]
     created_at: datetime
 
@@ -63,3 +64,23 @@ class WorkflowConfig(BaseModel):
 class QueryRequest(BaseModel):
     stack_id: int
     query: str
+
+class BatchQueryRequest(BaseModel):
+    stack_id: int
+    queries: List[str] = Field(..., min_length=1, max_length=10000)
+    max_concurrency: int = Field(4, ge=1, le=32)  # Concurrent LLM calls
+
+class EmbeddingMigrationRequest(BaseModel):
+    embedding_model: str  # 'openai' or 'gemini'
+    batch_size: int = Field(100, ge=1, le=2048)  # Chunks per embedding request
+    requests_per_minute: int = Field(60, ge=1)  # Embedding API requests, one per chunk for Gemini
+
+class EmbeddingMigrationStatus(BaseModel):
+    document_id: str
+    embedding_model: str
+    status: str  # 'running', 'completed', 'failed'
+    processed_chunks: int
+    total_chunks: int
+    error: Optional[str]
+    started_at: datetime
+    completed_at: Optional[datetime]
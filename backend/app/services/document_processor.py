@@ -1,8 +1,58 @@
 import os
-from typing import List, Dict
+import hashlib
+from typing import List, Dict, BinaryIO, Tuple
 import tempfile
 
+# Read uploads in 1 MiB pieces so large files never sit fully in memory
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+    pass
+
 class DocumentProcessor:
+    @staticmethod
+    def save_upload(source: BinaryIO, upload_dir: str, max_size: int,
+                    extension: str = "") -> Tuple[str, str, int]:
+        """Stream an upload to a content-addressed path, hashing it on the fly.
+
+        Returns (file_path, sha256 hex digest, size in bytes). The file is written
+        to a temporary file first and only moved into place once the full content
+        is known, so partial or oversized uploads never appear under a hash path.
+        """
+        os.makedirs(upload_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                while True:
+                    piece = source.read(UPLOAD_CHUNK_SIZE)
+                    if not piece:
+                        break
+                    size += len(piece)
+                    if size > max_size:
+                        raise UploadTooLargeError(
+                            f"File exceeds maximum upload size of {max_size} bytes"
+                        )
+                    digest.update(piece)
+                    buffer.write(piece)
+            
+            content_hash = digest.hexdigest()
+            target_dir = os.path.join(upload_dir, content_hash[:2])
+            os.makedirs(target_dir, exist_ok=True)
+            file_path = os.path.join(target_dir, content_hash + extension)
+            if os.path.exists(file_path):
+                # Identical content is already on disk
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, file_path)
+            return file_path, content_hash, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
     @staticmethod
     def extract_text_from_pdf(file_path: str) -> str:
         """Extract text from PDF file - simplified version for demo"""
@@ -0,0 +1,124 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+from .embedding_service import EmbeddingService
+
+class EmbeddingMigrator:
+    """Re-embeds a document's stored chunks with a new model in the background.
+
+    Each job builds a new index next to the live one while searches keep using
+    the old index, then swaps them atomically once every chunk is covered.
+    Chunks uploaded during the migration are picked up before the swap. A
+    failed job keeps its partial index and resumes where it stopped when
+    started again with the same model. requests_per_minute limits embedding
+    API requests, not batches: a Gemini batch costs one request per chunk.
+    """
+
+    def __init__(self, embedding_service: EmbeddingService, max_retries: int = 3):
+        self.embedding_service = embedding_service
+        self.max_retries = max_retries
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def start_migration(self, document_id: str, embedding_model: str,
+                        batch_size: int = 100, requests_per_minute: int = 60) -> Dict[str, Any]:
+        """Start or resume a migration job and return its status"""
+        with self._lock:
+            job = self.jobs.get(document_id)
+            if job and job["status"] == "running":
+                raise Exception("A migration is already running for this document")
+
+            if not self.embedding_service.chunk_count(document_id):
+                raise Exception("No chunks stored for this document")
+            if self.embedding_service.get_embedding_model(document_id) == embedding_model:
+                raise Exception(f"Document is already indexed with '{embedding_model}' embeddings")
+
+            # Resume a failed job for the same model, otherwise start from scratch
+            if not (job and job["status"] == "failed" and job["embedding_model"] == embedding_model):
+                if job and job["status"] == "failed":
+                    job["index"].clear()
+                job = {
+                    "document_id": document_id,
+                    "embedding_model": embedding_model,
+                    "index": self.embedding_service.create_index(document_id),
+                    "processed_chunks": 0,
+                    "started_at": datetime.utcnow()
+                }
+                self.jobs[document_id] = job
+
+            job.update({
+                "status": "running",
+                "error": None,
+                "batch_size": batch_size,
+                "requests_per_minute": requests_per_minute
+            })
+
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True)
+        thread.start()
+        return self.get_status(document_id)
+
+    def get_status(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Return the progress of the latest migration job for a document"""
+        job = self.jobs.get(document_id)
+        if not job:
+            return None
+
+        return {
+            "document_id": job["document_id"],
+            "embedding_model": job["embedding_model"],
+            "status": job["status"],
+            "processed_chunks": job["processed_chunks"],
+            "total_chunks": self.embedding_service.chunk_count(document_id),
+            "error": job["error"],
+            "started_at": job["started_at"],
+            "completed_at": job.get("completed_at")
+        }
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        document_id = job["document_id"]
+        interval = 60.0 / job["requests_per_minute"]
+        try:
+            while True:
+                chunks = self.embedding_service.get_chunks(
+                    document_id, job["processed_chunks"], job["processed_chunks"] + job["batch_size"]
+                )
+                if not chunks:
+                    # Caught up; the swap fails if chunks were added since, so loop again
+                    if self.embedding_service.swap_index(document_id, job["index"], job["embedding_model"]):
+                        break
+                    if job["index"].size != job["processed_chunks"]:
+                        raise Exception(
+                            f"New index holds {job['index'].size} vectors for "
+                            f"{job['processed_chunks']} processed chunks"
+                        )
+                    if not self.embedding_service.chunk_count(document_id):
+                        raise Exception("Document no longer exists")
+                    continue
+
+                started = time.monotonic()
+                embeddings = self._embed_with_retry(chunks, job["embedding_model"], interval)
+                if len(embeddings) != len(chunks):
+                    raise Exception(f"Embedding model returned {len(embeddings)} vectors for {len(chunks)} chunks")
+                job["index"].add(embeddings)
+                job["processed_chunks"] += len(chunks)
+
+                # Rate limit embedding API requests
+                requests = self.embedding_service.count_embedding_requests(len(chunks), job["embedding_model"])
+                time.sleep(max(0.0, interval * requests - (time.monotonic() - started)))
+
+            job["status"] = "completed"
+            job["completed_at"] = datetime.utcnow()
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = f"Embedding migration failed: {str(e)}"
+
+    def _embed_with_retry(self, chunks, embedding_model: str, interval: float):
+        """Embed a batch, backing off exponentially on errors such as rate limits"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embedding_service.generate_embeddings(chunks, embedding_model)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(max(interval, 1.0) * 2 ** attempt)
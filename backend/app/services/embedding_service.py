@@ -1,12 +1,22 @@
 import openai
 import google.generativeai as genai
-from typing import List, Dict
+from typing import List, Dict, Optional
 import os
+import shutil
+import tempfile
+import threading
 from dotenv import load_dotenv
 import json
+from .vector_index import ShardedVectorIndex, shutdown_search_pool
 
 load_dotenv()
 
+# Maximum inputs OpenAI accepts in one embeddings request
+OPENAI_EMBEDDING_BATCH_LIMIT = 2048
+
+# Seconds a replaced index is kept on disk so in-flight searches can finish
+RETIRED_INDEX_GRACE_PERIOD = 60
+
 class EmbeddingService:
     def __init__(self):
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
@@ -14,15 +24,33 @@ class EmbeddingService:
         # Simple in-memory storage for demo purposes
         self.documents = {}
         self.embeddings = {}
+        # Where each content hash's chunks live: (document id, first row, end row)
+        self.content_cache = {}
+        
+        # Sharded vector index per document, backed by files under index_dir
+        self.indexes = {}
+        # An empty VECTOR_INDEX_DIR means unset, i.e. the system temp dir
+        self.index_dir = tempfile.mkdtemp(prefix="vector_index-", dir=os.getenv("VECTOR_INDEX_DIR") or None)
+        
+        # Guards documents and indexes against concurrent uploads, searches and index swaps
+        self._lock = threading.RLock()
+    
+    def close(self) -> None:
+        """Stop the search workers and delete all index files"""
+        shutdown_search_pool()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
     
     def generate_embeddings_openai(self, texts: List[str]) -> List[List[float]]:
         """Generate embeddings using OpenAI"""
         try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-large",
-                input=texts
-            )
-            return [embedding.embedding for embedding in response.data]
+            embeddings = []
+            for start in range(0, len(texts), OPENAI_EMBEDDING_BATCH_LIMIT):
+                response = self.openai_client.embeddings.create(
+                    model="text-embedding-3-large",
+                    input=texts[start:start + OPENAI_EMBEDDING_BATCH_LIMIT]
+                )
+                embeddings.extend(embedding.embedding for embedding in response.data)
+            return embeddings
         except Exception as e:
             raise Exception(f"Error generating OpenAI embeddings: {str(e)}")
     
@@ -38,69 +66,205 @@ class EmbeddingService:
         except Exception as e:
             raise Exception(f"Error generating Gemini embeddings: {str(e)}")
     
+    def generate_embeddings(self, texts: List[str], embedding_model: str = "openai") -> List[List[float]]:
+        """Generate embeddings using the specified model"""
+        if embedding_model == "openai":
+            return self.generate_embeddings_openai(texts)
+        return self.generate_embeddings_gemini(texts)
+    
+    def count_embedding_requests(self, num_texts: int, embedding_model: str = "openai") -> int:
+        """Return how many API requests generate_embeddings makes for num_texts inputs"""
+        if embedding_model == "openai":
+            return -(-num_texts // OPENAI_EMBEDDING_BATCH_LIMIT)
+        # Gemini embeds one text per request
+        return num_texts
+    
+    def create_index(self, document_id: str) -> ShardedVectorIndex:
+        """Create an empty index in its own directory"""
+        return ShardedVectorIndex(tempfile.mkdtemp(prefix=f"{document_id}-", dir=self.index_dir))
+    
     def store_document_chunks(self, document_id: str, chunks: List[str], 
-                            metadata: Dict = None, embedding_model: str = "openai") -> None:
-        """Store document chunks with embeddings - simplified version"""
+                            metadata: Dict = None, embedding_model: str = None,
+                            content_hash: str = None) -> bool:
+        """Store document chunks with embeddings - simplified version
+
+        Chunks are appended to the document's existing chunks. Without an
+        explicit embedding model they are embedded with the model the
+        document's index currently uses; if a migration swaps the index while
+        they are being embedded, they are embedded again with the new model.
+        Passing a content hash reuses embeddings of identical content and
+        records the chunks for later uploads. Returns True if embeddings were
+        reused.
+        """
         try:
-            # Generate embeddings
-            if embedding_model == "openai":
-                embeddings = self.generate_embeddings_openai(chunks)
-            else:
-                embeddings = self.generate_embeddings_gemini(chunks)
-            
-            # Store in memory for demo purposes
-            self.documents[document_id] = {
-                'chunks': chunks,
-                'embeddings': embeddings,
-                'metadata': metadata or {}
-            }
+            while True:
+                model = self.get_embedding_model(document_id, default=embedding_model or "openai")
+                if embedding_model and model != embedding_model:
+                    raise Exception(
+                        f"Document {document_id} is indexed with '{model}' "
+                        f"embeddings, not '{embedding_model}'"
+                    )
+                
+                # Reuse embeddings of identical content, otherwise generate them
+                cached = self.get_cached_content(content_hash, model) if content_hash else None
+                if cached:
+                    embeddings = cached['embeddings']
+                else:
+                    embeddings = self.generate_embeddings(chunks, model)
+                
+                # Store in memory for demo purposes
+                with self._lock:
+                    doc_data = self.documents.get(document_id)
+                    if doc_data and doc_data['embedding_model'] != model:
+                        # The index was swapped to another model while embedding
+                        continue
+                    
+                    doc_data = self.documents.setdefault(document_id, {
+                        'chunks': [],
+                        'metadata': [],
+                        'content_hashes': set(),
+                        'embedding_model': model
+                    })
+                    if document_id not in self.indexes:
+                        self.indexes[document_id] = self.create_index(document_id)
+                    self.indexes[document_id].add(embeddings)
+                    start = len(doc_data['chunks'])
+                    doc_data['chunks'].extend(chunks)
+                    doc_data['metadata'].extend(dict(metadata or {}) for _ in chunks)
+                    
+                    if content_hash:
+                        doc_data['content_hashes'].add(content_hash)
+                        self.content_cache[content_hash] = (document_id, start, start + len(chunks))
+                    return cached is not None
         except Exception as e:
             raise Exception(f"Error storing document chunks: {str(e)}")
     
+    def has_content(self, document_id: str, content_hash: str) -> bool:
+        """Check whether content with this hash is already stored for a document"""
+        doc_data = self.documents.get(document_id)
+        return bool(doc_data) and content_hash in doc_data['content_hashes']
+    
+    def get_cached_chunks(self, content_hash: str) -> Optional[List[str]]:
+        """Return the chunk texts of previously stored identical content"""
+        with self._lock:
+            reference = self.content_cache.get(content_hash)
+            if not reference:
+                return None
+            
+            document_id, start, end = reference
+            doc_data = self.documents.get(document_id)
+            return doc_data['chunks'][start:end] if doc_data else None
+    
+    def get_cached_content(self, content_hash: str, 
+                           embedding_model: str = "openai") -> Optional[Dict]:
+        """Return previously computed chunks and embeddings for identical content
+
+        Embeddings are read back from the index rows that hold them, so they
+        are only reused while that index still uses the requested model.
+        """
+        with self._lock:
+            reference = self.content_cache.get(content_hash)
+            if not reference:
+                return None
+            
+            document_id, start, end = reference
+            doc_data = self.documents.get(document_id)
+            if not doc_data or doc_data['embedding_model'] != embedding_model:
+                return None
+            return {
+                'chunks': doc_data['chunks'][start:end],
+                'embeddings': self.indexes[document_id].get_vectors(start, end)
+            }
+    
+    def get_embedding_model(self, document_id: str, default: str = "openai") -> str:
+        """Return the embedding model a document's index was built with"""
+        doc_data = self.documents.get(document_id)
+        return doc_data['embedding_model'] if doc_data else default
+    
+    def chunk_count(self, document_id: str) -> int:
+        """Return the number of chunks stored for a document"""
+        doc_data = self.documents.get(document_id)
+        return len(doc_data['chunks']) if doc_data else 0
+    
+    def get_chunks(self, document_id: str, start: int = 0, end: int = None) -> List[str]:
+        """Return a slice of a document's stored chunk texts"""
+        with self._lock:
+            doc_data = self.documents.get(document_id)
+            return doc_data['chunks'][start:end] if doc_data else []
+    
+    def swap_index(self, document_id: str, index: ShardedVectorIndex, embedding_model: str) -> bool:
+        """Atomically replace a document's index with one built by another model
+
+        The swap only happens if the new index covers every stored chunk;
+        otherwise nothing changes and False is returned so the caller can
+        embed the chunks added in the meantime and try again.
+        """
+        with self._lock:
+            doc_data = self.documents.get(document_id)
+            if not doc_data or index.size != len(doc_data['chunks']):
+                return False
+            
+            old_index = self.indexes[document_id]
+            self.indexes[document_id] = index
+            doc_data['embedding_model'] = embedding_model
+        
+        # Searches that grabbed the old index before the swap may still be reading it
+        timer = threading.Timer(RETIRED_INDEX_GRACE_PERIOD, old_index.clear)
+        timer.daemon = True
+        timer.start()
+        return True
+    
     def search_similar_chunks(self, query: str, n_results: int = 5, 
                             document_id: str = None, embedding_model: str = "openai") -> List[Dict]:
         """Search for similar chunks using query embedding - simplified version"""
+        return self.search_similar_chunks_batch([query], n_results, document_id, embedding_model)[0]
+    
+    def search_similar_chunks_batch(self, queries: List[str], n_results: int = 5,
+                                  document_id: str = None, embedding_model: str = "openai") -> List[List[Dict]]:
+        """Search for similar chunks for many queries at once
+
+        All queries are embedded in one call and scored against each index as
+        a single matrix-matrix product. Returns one result list per query.
+        Queries are embedded with the model each index was built with, so
+        vectors are never compared across embedding spaces. A requested
+        embedding_model that differs is reported by validate_workflow.
+        """
         try:
-            # Generate query embedding
-            if embedding_model == "openai":
-                query_embedding = self.generate_embeddings_openai([query])[0]
-            else:
-                query_embedding = self.generate_embeddings_gemini([query])[0]
+            with self._lock:
+                targets = [
+                    (doc_id, doc_data, self.indexes[doc_id], doc_data['embedding_model'])
+                    for doc_id, doc_data in self.documents.items()
+                    if not document_id or doc_id == document_id
+                ]
             
-            # Simple similarity search (cosine similarity)
-            results = []
-            for doc_id, doc_data in self.documents.items():
-                if document_id and doc_id != document_id:
-                    continue
-                    
-                for i, (chunk, embedding) in enumerate(zip(doc_data['chunks'], doc_data['embeddings'])):
-                    # Simple cosine similarity calculation
-                    similarity = self._cosine_similarity(query_embedding, embedding)
-                    results.append({
-                        'content': chunk,
-                        'metadata': {
-                            'document_id': doc_id,
-                            'chunk_index': i,
-                            **doc_data['metadata']
-                        },
-                        'distance': 1 - similarity  # Convert similarity to distance
-                    })
+            # Generate query embeddings once per model in use
+            # Nothing indexed, so there is nothing to embed queries for
+            if not targets:
+                return [[] for _ in queries]
+            
+            query_embeddings = {}
+            for model in {target[3] for target in targets}:
+                query_embeddings[model] = self.generate_embeddings(queries, model)
+            
+            # Cosine similarity search over each document's sharded index
+            results = [[] for _ in queries]
+            for doc_id, doc_data, index, model in targets:
+                rows, similarities = index.search(query_embeddings[model], n_results)
+                for query_results, query_rows, query_similarities in zip(results, rows.tolist(), similarities.tolist()):
+                    for i, similarity in zip(query_rows, query_similarities):
+                        query_results.append({
+                            'content': doc_data['chunks'][i],
+                            'metadata': {
+                                'document_id': doc_id,
+                                'chunk_index': i,
+                                **doc_data['metadata'][i]
+                            },
+                            'distance': 1 - similarity  # Convert similarity to distance
+                        })
             
             # Sort by similarity and return top results
-            results.sort(key=lambda x: x['distance'])
-            return results[:n_results]
+            for query_results in results:
+                query_results.sort(key=lambda x: x['distance'])
+            return [query_results[:n_results] for query_results in results]
         except Exception as e:
             raise Exception(f"Error searching similar chunks: {str(e)}")
-    
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
-        import math
-        
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        magnitude1 = math.sqrt(sum(a * a for a in vec1))
-        magnitude2 = math.sqrt(sum(a * a for a in vec2))
-        
-        if magnitude1 == 0 or magnitude2 == 0:
-            return 0
-        
-        return dot_product / (magnitude1 * magnitude2)
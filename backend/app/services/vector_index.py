@@ -0,0 +1,230 @@
+import os
+import shutil
+import threading
+import uuid
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Maximum number of vectors stored in one shard file
+DEFAULT_SHARD_SIZE = int(os.getenv("VECTOR_SHARD_SIZE", "250000"))
+
+# Rows allocated for a new shard; capacity doubles as it fills, up to the shard size
+INITIAL_SHARD_CAPACITY = 1024
+
+# Below this many vectors it is cheaper to search in-process than to dispatch to workers
+DEFAULT_PARALLEL_THRESHOLD = int(os.getenv("VECTOR_PARALLEL_THRESHOLD", "50000"))
+
+# Memory-mapped shards opened by the current process, keyed by file path
+_open_shards = {}
+# API threads search in-process concurrently, so the cache needs a lock
+_open_shards_lock = threading.Lock()
+
+_search_pool = None
+
+
+def get_search_pool() -> ProcessPoolExecutor:
+    """Return the process pool shared by all sharded indexes"""
+    global _search_pool
+    if _search_pool is None:
+        workers = int(os.getenv("VECTOR_SEARCH_WORKERS", "0")) or os.cpu_count() or 1
+        # Spawned workers only import this module, not the web application
+        _search_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _search_pool
+
+
+def shutdown_search_pool() -> None:
+    """Stop the shared search workers, if they were started"""
+    global _search_pool
+    if _search_pool is not None:
+        _search_pool.shutdown(cancel_futures=True)
+        _search_pool = None
+
+
+def _load_shard(path: str, rows: int, dimension: int) -> np.ndarray:
+    """Memory-map the first rows of a shard file, reusing the mapping on later calls"""
+    with _open_shards_lock:
+        shard = _open_shards.get(path)
+        if shard is None or len(shard) < rows:
+            # Drop mappings of shards deleted by another process
+            for stale in [p for p in _open_shards if not os.path.exists(p)]:
+                _open_shards.pop(stale, None)
+            # Map exactly the published rows; remap once the shard has grown past them
+            shard = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dimension))
+            _open_shards[path] = shard
+    return shard[:rows]
+
+
+def _forget_shards(paths: List[str]) -> None:
+    """Drop this process's mappings of deleted shards so their memory is released"""
+    with _open_shards_lock:
+        for path in paths:
+            _open_shards.pop(path, None)
+
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return column indices and scores of the k highest scores per row, best first"""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-top, axis=1)
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+
+def _search_shard(path: str, offset: int, rows: int, queries: np.ndarray,
+                  k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Search a single shard; runs inside pool workers as well as in-process"""
+    shard = _load_shard(path, rows, queries.shape[1])
+    columns, scores = _top_k(queries @ shard.T, k)
+    return columns + offset, scores
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so a dot product equals cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class ShardedVectorIndex:
+    """Cosine-similarity index split into memory-mapped shards.
+
+    Vectors are normalized and appended in place to raw float32 shard files,
+    which grow by doubling and are never rewritten, so a search that read the
+    shard list earlier only ever sees fully written rows. Searches
+    over large indexes fan out to a process pool: each worker memory-maps the
+    shard files itself, so only the query and the per-shard top-k results are
+    pickled. Point ``index_dir`` at a tmpfs such as /dev/shm to keep shards in
+    shared memory.
+    """
+
+    def __init__(self, index_dir: str, shard_size: int = DEFAULT_SHARD_SIZE,
+                 parallel_threshold: int = DEFAULT_PARALLEL_THRESHOLD,
+                 executor: Optional[Executor] = None):
+        self.index_dir = index_dir
+        self.shard_size = shard_size
+        self.parallel_threshold = parallel_threshold
+        self.executor = executor
+        self.dimension = None
+        self.shards: List[Tuple[str, int]] = []  # (file path, row count)
+        # Writable mapping of the last shard and its allocated rows
+        self._tail = None
+        self._tail_capacity = 0
+        os.makedirs(index_dir, exist_ok=True)
+
+    @property
+    def size(self) -> int:
+        return sum(rows for _, rows in self.shards)
+
+    def add(self, vectors) -> None:
+        """Append vectors to the index, filling the last shard before starting new ones"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.size == 0:
+            return
+        if vectors.ndim != 2:
+            raise ValueError("Vectors must be a 2-dimensional array")
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Vector dimension {vectors.shape[1]} does not match index dimension {self.dimension}"
+            )
+        vectors = _normalize(vectors)
+
+        # Build the new shard list aside so concurrent searches see either the old or new row counts
+        shards = list(self.shards)
+        while len(vectors):
+            if not shards or shards[-1][1] == self.shard_size:
+                shards.append((self._create_shard(), 0))
+            path, rows = shards[-1]
+            piece = vectors[:self.shard_size - rows]
+            self._reserve(path, rows + len(piece))
+            self._tail[rows:rows + len(piece)] = piece
+            shards[-1] = (path, rows + len(piece))
+            vectors = vectors[len(piece):]
+        self.shards = shards
+
+    def search(self, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the k most similar vectors for each query.
+
+        Returns (row indices, cosine similarities), both shaped (queries, k)
+        and ordered best first. k is capped at the index size.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[np.newaxis, :]
+        shards = self.shards
+        if not shards:
+            return _top_k(np.empty((len(queries), 0), dtype=np.float32), k)
+        if queries.shape[1] != self.dimension:
+            raise ValueError(
+                f"Query dimension {queries.shape[1]} does not match index dimension {self.dimension}"
+            )
+        queries = _normalize(queries)
+
+        offsets = np.cumsum([0] + [rows for _, rows in shards[:-1]])
+        tasks = [(path, int(offset), rows, queries, k) for (path, rows), offset in zip(shards, offsets)]
+
+        if len(shards) > 1 and offsets[-1] + shards[-1][1] >= self.parallel_threshold:
+            executor = self.executor or get_search_pool()
+            futures = [executor.submit(_search_shard, *task) for task in tasks]
+            partials = [future.result() for future in futures]
+        else:
+            partials = [_search_shard(*task) for task in tasks]
+
+        # Merge per-shard top-k into a global top-k
+        rows = np.concatenate([p[0] for p in partials], axis=1)
+        scores = np.concatenate([p[1] for p in partials], axis=1)
+        columns, top = _top_k(scores, k)
+        return np.take_along_axis(rows, columns, axis=1), top
+
+    def get_vectors(self, start: int, end: int) -> np.ndarray:
+        """Return a copy of the stored, normalized vectors for rows start to end"""
+        pieces = []
+        offset = 0
+        for path, rows in self.shards:
+            low, high = max(start, offset), min(end, offset + rows)
+            if low < high:
+                pieces.append(np.array(_load_shard(path, rows, self.dimension)[low - offset:high - offset]))
+            offset += rows
+        if not pieces:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        return np.concatenate(pieces)
+
+    def clear(self) -> None:
+        """Delete all shard files along with the index directory"""
+        self._tail = None
+        self._tail_capacity = 0
+        _forget_shards([path for path, _ in self.shards])
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        self.shards = []
+        self.dimension = None
+
+    def _create_shard(self) -> str:
+        # Unique names mean a cached mapping never refers to a different shard
+        path = os.path.join(self.index_dir, f"shard-{uuid.uuid4().hex}.f32")
+        open(path, "wb").close()
+        self._tail = None
+        self._tail_capacity = 0
+        return path
+
+    def _reserve(self, path: str, rows: int) -> None:
+        """Make sure the last shard has room for rows, growing the file if needed"""
+        if rows <= self._tail_capacity:
+            return
+        capacity = max(self._tail_capacity, min(INITIAL_SHARD_CAPACITY, self.shard_size))
+        while capacity < rows:
+            capacity = min(capacity * 2, self.shard_size)
+        # Extending the file leaves rows already written, and any reader mappings of them, untouched
+        os.truncate(path, capacity * self.dimension * 4)
+        self._tail = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        self._tail_capacity = capacity
@@ -1,4 +1,5 @@
-from typing import Dict, List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Any, Optional, Iterator
 from ..models import WorkflowConfig, WorkflowNode, WorkflowEdge
 from .llm_service import LLMService
 from .embedding_service import EmbeddingService
@@ -10,8 +11,8 @@ class WorkflowExecutor:
         self.embedding_service = EmbeddingService()
         self.document_processor = DocumentProcessor()
     
-    def validate_workflow(self, workflow_config: WorkflowConfig) -> Dict[str, Any]:
-        """Validate workflow configuration"""
+    def validate_workflow(self, workflow_config: WorkflowConfig, stack_id: int = None) -> Dict[str, Any]:
+        """Validate workflow configuration, checking it against the stack's index when given"""
         errors = []
         warnings = []
         
@@ -34,6 +35,21 @@ class WorkflowExecutor:
             if not user_query_connected:
                 warnings.append("User Query node should be connected to other components")
         
+        # Queries are embedded with the model the stack's index was built with
+        document_id = str(stack_id) if stack_id else None
+        if document_id and self.embedding_service.chunk_count(document_id):
+            index_model = self.embedding_service.get_embedding_model(document_id)
+            for node in workflow_config.nodes:
+                if node.type != 'knowledge_base':
+                    continue
+                node_model = node.data.get('config', {}).get('embedding_model', 'openai')
+                if node_model != index_model:
+                    warnings.append(
+                        f"Knowledge Base embedding model '{node_model}' differs from the stack's "
+                        f"'{index_model}' index, which is used for queries; migrate the stack via "
+                        f"POST /stacks/{stack_id}/embedding-migration to switch models"
+                    )
+        
         return {
             "valid": len(errors) == 0,
             "errors": errors,
@@ -45,7 +61,7 @@ class WorkflowExecutor:
         """Execute the workflow with the given query"""
         try:
             # Validate workflow first
-            validation = self.validate_workflow(workflow_config)
+            validation = self.validate_workflow(workflow_config, stack_id)
             if not validation["valid"]:
                 return {
                     "success": False,
@@ -53,18 +69,15 @@ class WorkflowExecutor:
                     "details": validation["errors"]
                 }
             
-            # Find the user query node
-            user_query_node = next((n for n in workflow_config.nodes if n.type == 'user_query'), None)
-            if not user_query_node:
-                return {"success": False, "error": "No user query node found"}
-            
-            # Start execution from user query node
-            result = self._execute_node(user_query_node, user_query, workflow_config, stack_id)
+            # Evaluate the node that feeds the output node
+            result_node = self._find_result_node(workflow_config)
+            result = self._execute_node(result_node, user_query, workflow_config, stack_id)
             
             return {
                 "success": True,
                 "result": result,
-                "query": user_query
+                "query": user_query,
+                "warnings": validation["warnings"]
             }
         except Exception as e:
             return {
@@ -73,12 +86,20 @@ class WorkflowExecutor:
             }
     
     def _execute_node(self, node: WorkflowNode, input_data: str, 
-                     workflow_config: WorkflowConfig, stack_id: int = None) -> str:
-        """Execute a single node in the workflow"""
+                     workflow_config: WorkflowConfig, stack_id: int = None,
+                     context: Optional[str] = None) -> str:
+        """Execute a single node in the workflow
+
+        Knowledge base context retrieved ahead of time (e.g. for a whole batch)
+        can be passed in; otherwise knowledge base nodes are searched here.
+        """
         if node.type == 'user_query':
             return input_data
         
         elif node.type == 'knowledge_base':
+            if context is not None:
+                return context
+            
             # Get knowledge base configuration
             kb_config = node.data.get('config', {})
             embedding_model = kb_config.get('embedding_model', 'openai')
@@ -104,7 +125,8 @@ class WorkflowExecutor:
             use_web_search = llm_config.get('use_web_search', False)
             
             # Get context from knowledge base if connected
-            context = self._get_context_from_previous_nodes(node, workflow_config, input_data, stack_id)
+            if context is None:
+                context = self._get_context_from_previous_nodes(node, workflow_config, input_data, stack_id)
             
             # Generate response using LLM
             response = self.llm_service.generate_response(
@@ -129,40 +151,151 @@ class WorkflowExecutor:
                                        workflow_config: WorkflowConfig, 
                                        user_query: str, stack_id: int = None) -> str:
         """Get context from knowledge base nodes that are connected to the current node"""
-        # Find edges that connect to this node
-        incoming_edges = [e for e in workflow_config.edges if e.target == current_node.id]
-        
         context_parts = []
-        for edge in incoming_edges:
-            # Find the source node
-            source_node = next((n for n in workflow_config.nodes if n.id == edge.source), None)
-            if source_node and source_node.type == 'knowledge_base':
-                # Execute the knowledge base node to get context
-                kb_context = self._execute_node(source_node, user_query, workflow_config, stack_id)
-                if kb_context:
-                    context_parts.append(kb_context)
+        for kb_node in self._get_connected_knowledge_bases(current_node, workflow_config):
+            # Execute the knowledge base node to get context
+            kb_context = self._execute_node(kb_node, user_query, workflow_config, stack_id)
+            if kb_context:
+                context_parts.append(kb_context)
         
         return "\n\n".join(context_parts)
     
-    def process_document(self, file_path: str, file_type: str, stack_id: int = None) -> Dict[str, Any]:
+    def execute_workflow_batch(self, workflow_config: WorkflowConfig, queries: List[str],
+                              stack_id: int = None, max_concurrency: int = 4) -> Iterator[Dict[str, Any]]:
+        """Execute the workflow for many queries, yielding results as they complete
+
+        The caller validates the workflow once up front. Knowledge base
+        retrieval runs as one batched search per knowledge base node, and LLM
+        calls run on a bounded thread pool. Each yielded result carries the
+        index of its query.
+        """
+        result_node = self._find_result_node(workflow_config)
+        
+        # Retrieve context for every query up front
+        try:
+            if result_node.type == 'knowledge_base':
+                contexts = self._retrieve_context_batch([result_node], queries, stack_id)
+            elif result_node.type == 'llm_engine':
+                kb_nodes = self._get_connected_knowledge_bases(result_node, workflow_config)
+                contexts = self._retrieve_context_batch(kb_nodes, queries, stack_id)
+            else:
+                contexts = [None] * len(queries)
+        except Exception as e:
+            for index, query in enumerate(queries):
+                yield {
+                    "index": index,
+                    "query": query,
+                    "success": False,
+                    "error": f"Workflow execution failed: {str(e)}"
+                }
+            return
+        
+        # Evaluate each query through the same node logic as execute_workflow
+        pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            futures = {
+                pool.submit(
+                    self._execute_node, result_node, query, workflow_config, stack_id, contexts[index]
+                ): index
+                for index, query in enumerate(queries)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    yield {
+                        "index": index,
+                        "query": queries[index],
+                        "success": True,
+                        "result": future.result()
+                    }
+                except Exception as e:
+                    yield {
+                        "index": index,
+                        "query": queries[index],
+                        "success": False,
+                        "error": f"Workflow execution failed: {str(e)}"
+                    }
+        finally:
+            # Drop queued calls if the consumer stops reading early
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _find_result_node(self, workflow_config: WorkflowConfig) -> WorkflowNode:
+        """Find the node whose output feeds the output node, defaulting to the user query node"""
+        output_node = next(n for n in workflow_config.nodes if n.type == 'output')
+        for edge in workflow_config.edges:
+            if edge.target == output_node.id:
+                source_node = next((n for n in workflow_config.nodes if n.id == edge.source), None)
+                if source_node:
+                    return source_node
+        return next(n for n in workflow_config.nodes if n.type == 'user_query')
+    
+    def _get_connected_knowledge_bases(self, current_node: WorkflowNode,
+                                       workflow_config: WorkflowConfig) -> List[WorkflowNode]:
+        """Get knowledge base nodes with an edge into the current node"""
+        source_ids = {e.source for e in workflow_config.edges if e.target == current_node.id}
+        return [n for n in workflow_config.nodes if n.id in source_ids and n.type == 'knowledge_base']
+    
+    def _retrieve_context_batch(self, kb_nodes: List[WorkflowNode], queries: List[str],
+                                stack_id: int = None) -> List[str]:
+        """Retrieve combined knowledge base context for each query"""
+        context_parts = [[] for _ in queries]
+        for kb_node in kb_nodes:
+            kb_config = kb_node.data.get('config', {})
+            batch_chunks = self.embedding_service.search_similar_chunks_batch(
+                queries=queries,
+                n_results=5,
+                document_id=str(stack_id) if stack_id else None,
+                embedding_model=kb_config.get('embedding_model', 'openai')
+            )
+            for parts, similar_chunks in zip(context_parts, batch_chunks):
+                kb_context = "\n\n".join([chunk['content'] for chunk in similar_chunks])
+                if kb_context:
+                    parts.append(kb_context)
+        
+        return ["\n\n".join(parts) for parts in context_parts]
+    
+    def process_document(self, file_path: str, file_type: str, stack_id: int = None,
+                        content_hash: str = None, embedding_model: str = None) -> Dict[str, Any]:
         """Process and store a document for the knowledge base"""
         try:
-            # Extract text from document
-            text = self.document_processor.extract_text_from_file(file_path, file_type)
+            document_id = str(stack_id) if stack_id else "default"
+            
+            # Identical content already indexed for this stack - nothing to do
+            if content_hash and self.embedding_service.has_content(document_id, content_hash):
+                return {
+                    "success": True,
+                    "chunks_created": 0,
+                    "deduplicated": True,
+                    "message": "Document already processed for this stack"
+                }
+            
+            # Reuse chunks from an earlier upload of the same content
+            chunks = None
+            if content_hash:
+                chunks = self.embedding_service.get_cached_chunks(content_hash)
             
-            # Chunk the text
-            chunks = self.document_processor.chunk_text(text)
+            if not chunks:
+                # Extract text from document
+                text = self.document_processor.extract_text_from_file(file_path, file_type)
+                
+                # Chunk the text
+                chunks = self.document_processor.chunk_text(text)
             
-            # Store chunks with embeddings
-            self.embedding_service.store_document_chunks(
-                document_id=str(stack_id) if stack_id else "default",
+            # Store chunks with embeddings; without an explicit model the
+            # stack's current embedding model is used
+            reused = self.embedding_service.store_document_chunks(
+                document_id=document_id,
                 chunks=chunks,
-                metadata={"file_type": file_type, "file_path": file_path}
+                metadata={"file_type": file_type, "file_path": file_path},
+                embedding_model=embedding_model,
+                content_hash=content_hash
             )
             
             return {
                 "success": True,
-                "chunks_created": len(chunks),
+                "chunks_created": 0 if reused else len(chunks),
+                "chunks_reused": len(chunks) if reused else 0,
+                "deduplicated": reused,
                 "message": "Document processed and stored successfully"
             }
         except Exception as e:
@@ -0,0 +1,72 @@
+"""Benchmark sharded vector search throughput and latency across worker counts.
+
+Usage (from the backend directory):
+    python benchmarks/vector_search_benchmark.py --vectors 1000000 --dim 768
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.vector_index import ShardedVectorIndex
+
+
+def run(index: ShardedVectorIndex, queries: np.ndarray, k: int, batch: int):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch):
+        t0 = time.perf_counter()
+        index.search(queries[i:i + batch], k)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--batch", type=int, default=1, help="Queries per search call")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--index-dir", default=None, help="Directory for shard files, e.g. /dev/shm")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+    worker_counts = sorted({w for w in (1, 2, 4, 8, 16, 32, 64) if w < args.max_workers} | {args.max_workers})
+
+    with tempfile.TemporaryDirectory(dir=args.index_dir) as index_dir:
+        # One shard per worker at the highest worker count
+        shard_size = -(-args.vectors // args.max_workers)
+        index = ShardedVectorIndex(index_dir, shard_size=shard_size, parallel_threshold=0)
+        for start in range(0, args.vectors, 100_000):
+            rows = min(100_000, args.vectors - start)
+            index.add(rng.standard_normal((rows, args.dim), dtype=np.float32))
+
+        print(f"{args.vectors} vectors x {args.dim} dims in {len(index.shards)} shards, "
+              f"{args.queries} queries, batch {args.batch}, k={args.k}")
+        print(f"{'workers':>8} {'qps':>10} {'p50 ms':>10} {'p95 ms':>10} {'speedup':>8}")
+
+        baseline = None
+        for workers in worker_counts:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                index.executor = pool
+                # Warm up so workers have imported numpy and mapped the shards
+                run(index, queries[:workers], args.k, 1)
+                qps, p50, p95 = run(index, queries, args.k, args.batch)
+            baseline = baseline or qps
+            print(f"{workers:>8} {qps:>10.1f} {p50 * 1000:>10.2f} {p95 * 1000:>10.2f} {qps / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()